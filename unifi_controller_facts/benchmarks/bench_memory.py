@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------------------------------------------------
+# bench_memory - Memory used by large client lists, dict-of-dicts versus the compact record layer
+# ---------------------------------------------------------------------------------------------------------------------
+# Builds a synthetic list_online_clients response with <clients> clients of 60+ keys each, then measures with
+# tracemalloc (on top of the response text itself):
+#  envelope check => json.loads of the whole body (the old process_response) versus read_envelope
+#  client index   => json.loads keeping every client dict versus ClientRecord.from_text keeping compact records
+#
+# Timings include the tracemalloc overhead and are only comparable with each other.
+#
+# Usage
+#  python benchmarks/bench_memory.py [--clients 50000]
+# ---------------------------------------------------------------------------------------------------------------------
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils"))
+
+from unifi_records import ClientRecord, read_envelope
+
+
+def synthetic_response(count):
+    rng = random.Random(0)
+    essids = ["Corp", "Guests", "IoT", "Lab"]
+    ouis = ["Apple", "Samsung", "Intel", "Dell", "Espressif", "Google"]
+    aps = ["f0:9f:c2:00:00:%02x" % i for i in range(40)]
+    clients = []
+    for i in range(count):
+        mac = "00:11:%02x:%02x:%02x:%02x" % ((i >> 24) & 255, (i >> 16) & 255, (i >> 8) & 255, i & 255)
+        client = {
+            "_id": "%024x" % i, "site_id": "5b3a0000000000000000000a", "mac": mac, "hostname": "host-%d" % i,
+            "name": "client %d" % i, "ip": "10.%d.%d.%d" % ((i >> 16) & 255, (i >> 8) & 255, i & 255),
+            "oui": rng.choice(ouis), "is_wired": False, "is_guest": rng.random() < 0.2, "essid": rng.choice(essids),
+            "bssid": rng.choice(aps), "network": "LAN", "network_id": "5b3a0000000000000000000b", "ap_mac": rng.choice(aps),
+            "radio": rng.choice(["ng", "na"]), "radio_proto": "ac", "channel": rng.choice([1, 6, 11, 36, 44]),
+            "signal": -rng.randint(40, 80), "noise": -95, "rssi": rng.randint(20, 60), "uptime": rng.randint(0, 86400),
+            "tx_bytes": rng.randint(0, 1 << 32), "rx_bytes": rng.randint(0, 1 << 32), "tx_packets": rng.randint(0, 1 << 20),
+            "rx_packets": rng.randint(0, 1 << 20), "tx_rate": 866700, "rx_rate": 866700, "last_seen": 1539000000 + i,
+            "first_seen": 1530000000 + i, "assoc_time": 1538990000, "latest_assoc_time": 1538990000,
+        }
+        for extra in range(30):
+            client["stat_%02d" % extra] = rng.randint(0, 1000)
+        clients.append(client)
+    return json.dumps({"meta": {"rc": "ok"}, "data": clients})
+
+
+def measure(function, text):
+    gc.collect()
+    tracemalloc.start()
+    started = time.time()
+    kept = function(text)
+    elapsed = time.time() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    gc.collect()
+    return peak / 1048576.0, retained / 1048576.0, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory use of dict and compact record client lists")
+    parser.add_argument("--clients", type=int, default=50000, help="Number of synthetic clients (default: 50000)")
+    args = parser.parse_args()
+
+    text = synthetic_response(args.clients)
+    print("%d clients, %.1f MB of response text" % (args.clients, len(text) / 1048576.0))
+    print("%-32s %10s %12s %8s" % ("", "peak MB", "retained MB", "s"))
+    cases = [
+        ("envelope check, json.loads", lambda body: json.loads(body)['meta']['rc']),
+        ("envelope check, read_envelope", lambda body: read_envelope(body)[0]['rc']),
+        ("client index, dicts", lambda body: json.loads(body)['data']),
+        ("client index, ClientRecord", ClientRecord.from_text),
+    ]
+    for name, function in cases:
+        print("%-32s %10.1f %12.1f %8.2f" % ((name,) + measure(function, text)))
+
+
+if __name__ == '__main__':
+    main()
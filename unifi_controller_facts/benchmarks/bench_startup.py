@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------------------------------------------------
+# bench_startup - Import-to-first-request time of the UniFi client, per transport
+# ---------------------------------------------------------------------------------------------------------------------
+# Ansible starts a fresh interpreter for every task on every host, so what matters is the time from the first import
+# to the first answered query.  Each sample runs in a new interpreter against a local stand-in controller, for two
+# cases per transport:
+#  client    => module_utils/unifi.py alone, the cost of the shared client
+#  module    => library/unifi_controller_facts.py with module_utils importable as ansible.module_utils, the way Ansible
+#               ships them, run through its main() in direct mode, so its own up front imports (AnsibleModule,
+#               unifi_broker, unifi_records, unifi_topology) are included
+# and measures:
+#  import    => importing the client or the module
+#  first     => until list_sites is answered (includes the lazy transport imports, and argument parsing for the module)
+#  process   => wall clock of the whole interpreter, as seen by the parent
+#
+# The module case needs ansible, it is reported as unavailable without it.
+#
+# Usage
+#  python benchmarks/bench_startup.py [--runs 20]
+# ---------------------------------------------------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE_UTILS = os.path.join(ROOT, "module_utils")
+MODULE = os.path.join(ROOT, "library", "unifi_controller_facts.py")
+
+CLIENT_SAMPLE = """
+import sys, time, json
+t0 = time.time()
+sys.path.insert(0, %(module_utils)r)
+import unifi
+t1 = time.time()
+client = unifi.UniFiClient(%(url)r, "admin", "changeme", transport=%(transport)r)
+client.login()
+client.query('list_sites')
+t2 = time.time()
+print(json.dumps({"import": t1 - t0, "first": t2 - t0}))
+"""
+
+MODULE_SAMPLE = """
+import sys, time, json
+t0 = time.time()
+import importlib.util, io
+import ansible.module_utils
+ansible.module_utils.__path__.append(%(module_utils)r)
+spec = importlib.util.spec_from_file_location("unifi_controller_facts", %(module)r)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+t1 = time.time()
+# Arguments passed the way "python unifi_controller_facts.py <args>" takes them when a module is run by hand
+sys.argv = [%(module)r, json.dumps({"ANSIBLE_MODULE_ARGS": {
+    "controller_baseURL": %(url)r, "controller_username": "admin", "controller_password": "changeme",
+    "query": "list_sites", "use_broker": False, "transport": %(transport)r}})]
+stdout, sys.stdout = sys.stdout, io.StringIO()
+try:
+    module.main()
+except SystemExit:
+    pass
+result, sys.stdout = json.loads(sys.stdout.getvalue()), stdout
+t2 = time.time()
+if result.get('failed'):
+    sys.exit(result.get('msg'))
+print(json.dumps({"import": t1 - t0, "first": t2 - t0}))
+"""
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _reply(self, headers=None):
+        body = json.dumps({"meta": {"rc": "ok"}, "data": [{"name": "default", "desc": "Default"}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._reply({"Set-Cookie": "unifises=benchmark; Path=/"})
+
+    def do_GET(self):
+        self._reply()
+
+    def log_message(self, *args):
+        pass
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def run(sample_code, url, transport, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.time()
+        code = sample_code % {"module_utils": MODULE_UTILS, "module": MODULE, "url": url, "transport": transport}
+        output = subprocess.check_output([sys.executable, "-c", code])
+        sample = json.loads(output.decode('utf-8'))
+        sample["process"] = time.time() - started
+        samples.append(sample)
+    return dict((key, median([sample[key] for sample in samples])) for key in ("import", "first", "process"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import-to-first-request time of the UniFi client")
+    parser.add_argument("--runs", type=int, default=20, help="Interpreters to start per transport (default: 20)")
+    args = parser.parse_args()
+
+    server = HTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = "http://127.0.0.1:%d" % server.server_address[1]
+
+    print("%-8s %-12s %10s %10s %10s" % ("case", "transport", "import ms", "first ms", "process ms"))
+    for case, sample_code in (("client", CLIENT_SAMPLE), ("module", MODULE_SAMPLE)):
+        for transport in ("requests", "http.client"):
+            try:
+                result = run(sample_code, url, transport, args.runs)
+            except subprocess.CalledProcessError:
+                print("%-8s %-12s %10s" % (case, transport, "unavailable"))
+                continue
+            print("%-8s %-12s %10.1f %10.1f %10.1f" % (case, transport, result["import"] * 1000, result["first"] * 1000,
+                                                       result["process"] * 1000))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------------------------------------------------
+# unifi_broker - Long-lived local broker for the unifi_controller_facts module
+# ---------------------------------------------------------------------------------------------------------------------
+# Keeps one logged in UniFiClient per (controller, username, password) and answers module queries over a Unix socket.
+# Identical queries that arrive while one is already in flight (e.g. 50 forks all asking for list_sites) wait for that
+# request instead of issuing their own.  Expired sessions are logged back in transparently.
+#
+# Usage
+#  python bin/unifi_broker.py [--socket ~/.ansible/unifi_broker.sock] [--pool-size 50] [--timeout 60]
+#
+# The module uses the broker whenever the socket exists and falls back to direct mode when it does not.
+# ---------------------------------------------------------------------------------------------------------------------
+
+import argparse
+import hashlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils"))
+
+from unifi import DEFAULT_SITE, ENDPOINTS, UniFiClient, UniFiLoginError
+from unifi_broker import broker_socket_path, read_message, send_message
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: ControllerSession
+# ---------------------------------------------------------------------------------------------------------------------
+# One logged in client, shared by every request with the same controller and credentials.  The client logs itself in
+# and back in when the session expires, once for all the threads that saw it expire.
+# ---------------------------------------------------------------------------------------------------------------------
+class ControllerSession(object):
+
+    def __init__(self, controller_baseURL, controller_username, controller_password, pool_size, timeout):
+        self.client = UniFiClient(controller_baseURL, controller_username, controller_password, timeout=timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.client.transport.session.mount("https://", adapter)
+        self.client.transport.session.mount("http://", adapter)
+
+    def request(self, query, data, site):
+        try:
+            response = self.client.request(query, data, site, relogin=True)
+        except UniFiLoginError as e:
+            return {"login": e.result}
+        return {"status_code": response.status_code, "text": response.text}
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: InFlight
+# ---------------------------------------------------------------------------------------------------------------------
+# A request being made on behalf of one or more waiting connections
+# ---------------------------------------------------------------------------------------------------------------------
+class InFlight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.reply = None
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: Broker
+# ---------------------------------------------------------------------------------------------------------------------
+# Session registry and request coalescing, independent of the socket server
+#
+# NOTES:
+# - a leader makes at most two logins and two requests, each bounded by <timeout>, so followers give up after four
+#   times <timeout> rather than waiting forever on a leader stuck in a hung request
+# ---------------------------------------------------------------------------------------------------------------------
+class Broker(object):
+
+    def __init__(self, pool_size=50, timeout=60):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.in_flight = {}
+
+    def session(self, request):
+        password_hash = hashlib.sha256(request['controller_password'].encode('utf-8')).hexdigest()
+        key = (request['controller_baseURL'].rstrip("/"), request['controller_username'], password_hash)
+        with self.lock:
+            if key not in self.sessions:
+                self.sessions[key] = ControllerSession(request['controller_baseURL'], request['controller_username'],
+                                                       request['controller_password'], self.pool_size, self.timeout)
+            return key, self.sessions[key]
+
+    def handle(self, request):
+        if request.get('query') not in ENDPOINTS:
+            return {"error": "Unknown UniFi query: %s" % request.get('query')}
+        session_key, session = self.session(request)
+        site = request.get('controller_site') or DEFAULT_SITE
+        data = request.get('data') or {}
+        key = (session_key, site, request['query'], json.dumps(data, sort_keys=True))
+
+        with self.lock:
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[key] = InFlight()
+
+        if not leader:
+            if not flight.done.wait(4 * self.timeout):
+                return {"error": "Timed out waiting for the identical in-flight %s request" % request['query']}
+            return flight.reply
+
+        try:
+            flight.reply = session.request(request['query'], data, site)
+        except (requests.RequestException, ValueError) as e:
+            flight.reply = {"error": str(e)}
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            flight.done.set()
+        return flight.reply
+
+
+class BrokerRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = read_message(self.rfile)
+        except ValueError:
+            return
+        if request is None:
+            return
+        send_message(self.connection, self.server.broker.handle(request))
+
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, broker):
+        self.broker = broker
+        socketserver.UnixStreamServer.__init__(self, path, BrokerRequestHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local broker sharing UniFi controller sessions between Ansible forks")
+    parser.add_argument("--socket", default=None, help="Unix socket to listen on (default: $UNIFI_BROKER_SOCKET or ~/.ansible/unifi_broker.sock)")
+    parser.add_argument("--pool-size", type=int, default=50, help="Maximum pooled connections per controller (default: 50)")
+    parser.add_argument("--timeout", type=int, default=60, help="Seconds to wait for the controller to answer (default: 60)")
+    args = parser.parse_args()
+
+    path = broker_socket_path(args.socket)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            sys.exit("A broker is already listening on " + path)
+        except socket.error:
+            os.unlink(path)
+        finally:
+            probe.close()
+
+    # The socket carries controller credentials, keep it private to the current user
+    old_umask = os.umask(0o177)
+    try:
+        server = BrokerServer(path, Broker(args.pool_size, args.timeout))
+    finally:
+        os.umask(old_umask)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
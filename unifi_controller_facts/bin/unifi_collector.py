@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------------------------------------------------
+# unifi_collector - Scheduled multi-controller collector
+# ---------------------------------------------------------------------------------------------------------------------
+# Runs the module queries against many controllers on a declarative schedule and writes each answer to a local sink,
+# one long-lived process instead of a cron-driven playbook per query.
+#
+#  - jobs become due every <interval> seconds and run in <priority> order (lower first) when several are due
+#  - each controller has at most <concurrency> requests in flight, on a pool of logged in clients
+#  - a job whose last result in the sink is younger than its <max_age> (default = <interval>) is skipped, so restarts
+#    and overlapping schedules do not refetch fresh data
+#  - a failed job is retried after 30 seconds, doubling on every further failure, but never later than <interval>
+#
+# Schedule file (YAML needs PyYAML, JSON always works)
+#  sink: /var/lib/unifi_collector
+#  controllers:
+#    hq:
+#      controller_baseURL: "https://10.0.0.2:8443"
+#      controller_username: "admin"
+#      controller_password_env: "UNIFI_HQ_PASSWORD"     # or controller_password
+#      concurrency: 4                                   # default 2
+#      transport: "http.client"                         # default requests
+#  jobs:
+#    - {controller: hq, site: default, query: site_health_metrics, interval: 60, priority: 0}
+#    - {controller: hq, site: [default, branch1], query: list_site_settings, interval: 86400, priority: 9}
+#    - {controller: hq, site: default, query: list_events, interval: 300, data: {since: 1}}
+#
+# Results are written to <sink>/<controller>/<site>/<query>.json, or <query>-<hash of data>.json for jobs with data so
+# that jobs differing only in their data keep separate results, as
+#  {"fetched_at": (float), "controller": (str), "site": (str), "query": (str), "data": (dict), "status": (int),
+#   "response": (json)}
+#
+# Usage
+#  python bin/unifi_collector.py schedule.yml [--once]
+# ---------------------------------------------------------------------------------------------------------------------
+
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils"))
+
+from unifi import DEFAULT_SITE, ENDPOINTS, UniFiClient
+from unifi_records import read_envelope
+
+log = logging.getLogger("unifi_collector")
+
+RETRY_DELAY = 30
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: load_schedule
+# ---------------------------------------------------------------------------------------------------------------------
+# Reads and validates a schedule file, expanding jobs with a list of sites into one job per site
+#
+# Returns
+#  (sink, controllers, jobs)
+# ---------------------------------------------------------------------------------------------------------------------
+def load_schedule(path):
+    with open(path) as schedule_file:
+        if path.endswith(".json"):
+            schedule = json.load(schedule_file)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is required to read %s, use a .json schedule instead" % path)
+            schedule = yaml.safe_load(schedule_file)
+
+    controllers = schedule.get('controllers') or {}
+    for name, controller in controllers.items():
+        for key in ('controller_baseURL', 'controller_username'):
+            if not controller.get(key):
+                raise ValueError("Controller %s is missing %s" % (name, key))
+        if controller.get('controller_password_env'):
+            controller['controller_password'] = os.environ.get(controller['controller_password_env'])
+        if controller.get('controller_password') is None:
+            raise ValueError("Controller %s has no controller_password or controller_password_env" % name)
+
+    jobs = []
+    for entry in schedule.get('jobs') or []:
+        if entry.get('controller') not in controllers:
+            raise ValueError("Job %r uses unknown controller %r" % (entry, entry.get('controller')))
+        if entry.get('query') not in ENDPOINTS:
+            raise ValueError("Job %r uses unknown query %r" % (entry, entry.get('query')))
+        if not entry.get('interval') or int(entry['interval']) <= 0:
+            raise ValueError("Job %r needs a positive interval" % (entry,))
+        sites = entry.get('site') or DEFAULT_SITE
+        if not isinstance(sites, list):
+            sites = [sites]
+        for site in sites:
+            jobs.append(Job(entry['controller'], site, entry['query'], int(entry['interval']),
+                            int(entry.get('priority', 5)), entry.get('max_age'), entry.get('data')))
+
+    return schedule.get('sink') or "unifi_collector", controllers, jobs
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: Job
+# ---------------------------------------------------------------------------------------------------------------------
+# One (controller, site, query, data) to keep fresh, <failures> counts the failed runs since the last success
+# ---------------------------------------------------------------------------------------------------------------------
+class Job(object):
+    __slots__ = ('controller', 'site', 'query', 'interval', 'priority', 'max_age', 'data', 'failures')
+
+    def __init__(self, controller, site, query, interval, priority=5, max_age=None, data=None):
+        self.controller = controller
+        self.site = site
+        self.query = query
+        self.interval = interval
+        self.priority = priority
+        self.max_age = interval if max_age is None else int(max_age)
+        self.data = data or {}
+        self.failures = 0
+
+    # Name of the job's result, the query plus a short hash of its data when it has any
+    def name(self):
+        if not self.data:
+            return self.query
+        return self.query + "-" + hashlib.sha1(json.dumps(self.data, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    # Delay before the next run, <interval> after a success, a backoff capped at <interval> after failures
+    def delay(self):
+        if not self.failures:
+            return self.interval
+        return min(self.interval, RETRY_DELAY * 2 ** min(self.failures - 1, 16))
+
+    def __repr__(self):
+        return "%s/%s/%s" % (self.controller, self.site, self.name())
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: DirectorySink
+# ---------------------------------------------------------------------------------------------------------------------
+# Writes one JSON file per job, atomically, and answers how old the last result is from the file time
+# ---------------------------------------------------------------------------------------------------------------------
+class DirectorySink(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, job):
+        return os.path.join(self.path, job.controller, job.site, job.name() + ".json")
+
+    def fetched_at(self, job):
+        try:
+            return os.path.getmtime(self._file(job))
+        except OSError:
+            return None
+
+    def write(self, job, fetched_at, status_code, text):
+        path = self._file(job)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(path)):
+                raise
+        header = json.dumps({"fetched_at": fetched_at, "controller": job.controller, "site": job.site, "query": job.query,
+                             "data": job.data, "status": status_code})
+        temporary = path + ".tmp"
+        # The response is already JSON, splice it in rather than decoding and re-encoding it
+        with open(temporary, "w") as result_file:
+            result_file.write(header[:-1] + ',"response":' + text + "}\n")
+        os.rename(temporary, path)
+        os.utime(path, (fetched_at, fetched_at))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: ControllerPool
+# ---------------------------------------------------------------------------------------------------------------------
+# <concurrency> clients for one controller, each logging itself in on first use and again when its session expires
+# ---------------------------------------------------------------------------------------------------------------------
+class ControllerPool(object):
+
+    def __init__(self, name, controller):
+        self.name = name
+        self.concurrency = int(controller.get('concurrency', 2))
+        self.clients = queue.Queue()
+        for _ in range(self.concurrency):
+            self.clients.put(UniFiClient(controller['controller_baseURL'], controller['controller_username'],
+                                         controller['controller_password'], transport=controller.get('transport', 'requests')))
+
+    def request(self, job):
+        client = self.clients.get()
+        try:
+            return client.request(job.query, job.data, job.site, relogin=True)
+        finally:
+            self.clients.put(client)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: Collector
+# ---------------------------------------------------------------------------------------------------------------------
+# Priority scheduler
+#  timeline => heap of (due, priority, seq, job) for every job not yet due
+#  ready    => per controller heap of (priority, due, seq, job) for due jobs waiting for a free slot
+# A dispatcher loop moves due jobs from the timeline to their controller's ready heap and starts the most urgent ones
+# while the controller has free slots, workers report back and reschedule their job.
+# ---------------------------------------------------------------------------------------------------------------------
+class Collector(object):
+
+    def __init__(self, controllers, jobs, sink, once=False):
+        self.pools = dict((name, ControllerPool(name, controller)) for name, controller in controllers.items())
+        self.sink = sink
+        self.once = once
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.timeline = []
+        self.ready = dict((name, []) for name in controllers)
+        self.running = dict((name, 0) for name in controllers)
+        self.stopping = False
+        now = time.time()
+        for job in jobs:
+            heapq.heappush(self.timeline, (now, job.priority, next(self.sequence), job))
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+    def _schedule(self, job, due):
+        if not self.once:
+            heapq.heappush(self.timeline, (due, job.priority, next(self.sequence), job))
+
+    def _run(self, job):
+        started = time.time()
+        succeeded = False
+        try:
+            response = self.pools[job.controller].request(job)
+            meta, data_kind = read_envelope(response.text)
+            if meta.get('rc') == "ok":
+                self.sink.write(job, started, response.status_code, response.text)
+                succeeded = True
+                log.info("%r fetched in %.2fs", job, time.time() - started)
+            else:
+                log.warning("%r failed with HTTP %s: %s", job, response.status_code, meta.get('msg'))
+        except Exception as e:
+            log.warning("%r failed: %s", job, e)
+        finally:
+            with self.condition:
+                self.running[job.controller] -= 1
+                job.failures = 0 if succeeded else job.failures + 1
+                self._schedule(job, started + job.delay())
+                self.condition.notify_all()
+
+    def _dispatch(self, now):
+        while self.timeline and self.timeline[0][0] <= now:
+            due, priority, sequence, job = heapq.heappop(self.timeline)
+            heapq.heappush(self.ready[job.controller], (priority, due, sequence, job))
+        for name, ready in self.ready.items():
+            while ready and self.running[name] < self.pools[name].concurrency:
+                priority, due, sequence, job = heapq.heappop(ready)
+                fetched_at = self.sink.fetched_at(job)
+                if fetched_at is not None and now - fetched_at < job.max_age:
+                    log.debug("%r is still fresh, skipped", job)
+                    self._schedule(job, fetched_at + max(job.interval, job.max_age))
+                    continue
+                self.running[name] += 1
+                worker = threading.Thread(target=self._run, args=(job,))
+                worker.daemon = True
+                worker.start()
+
+    def run(self):
+        with self.condition:
+            while not self.stopping:
+                now = time.time()
+                self._dispatch(now)
+                if self.once and not self.timeline and not any(self.ready.values()) and not any(self.running.values()):
+                    break
+                # Bounded waits keep the loop responsive to signals
+                if self.timeline:
+                    self.condition.wait(min(max(self.timeline[0][0] - now, 0.01), 1))
+                else:
+                    self.condition.wait(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect UniFi controller queries on a schedule")
+    parser.add_argument("schedule", help="Schedule file (.yml/.yaml or .json)")
+    parser.add_argument("--once", action="store_true", help="Run every job that is not fresh once, then exit")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log every fetch and skip")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+
+    try:
+        sink, controllers, jobs = load_schedule(args.schedule)
+    except (IOError, ValueError) as e:
+        sys.exit(str(e))
+
+    collector = Collector(controllers, jobs, DirectorySink(sink), once=args.once)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: collector.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: collector.stop())
+
+    collector.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------------------------------------------------
+# check_events - unifi_controller_events against a local WebSocket stand-in controller
+# ---------------------------------------------------------------------------------------------------------------------
+# Starts a standard library stand-in that answers /api/login and serves scripted /wss/s/<scenario>/events feeds,
+# then runs stream_events from the module against each scenario:
+#  match        => sync pushes that would match are ignored, streaming stops on the first matching event
+#  timeout      => a few events, then a silent feed until the timeout expires
+#  max_events   => streaming stops after max_events events, all of them written to the NDJSON file
+#  backpressure => read_events alone on a large feed with a 4 event buffer nobody drains, the stand-in must be blocked
+#                  long before it sent everything
+#  rejected     => a site without a feed answers the handshake with 404, the module reports it as an error result
+#  output_path  => an output file that cannot be opened is reported before any socket or reader thread is started
+#
+# Needs what the module needs: ansible, requests and websocket-client.
+#
+# Usage
+#  python checks/check_events.py
+# ---------------------------------------------------------------------------------------------------------------------
+
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Make the repository module_utils importable as ansible.module_utils.*, the way Ansible ships them with the module
+import ansible.module_utils
+ansible.module_utils.__path__.append(os.path.join(ROOT, "module_utils"))
+
+from ansible.module_utils.unifi import UniFiClient
+spec = importlib.util.spec_from_file_location("unifi_controller_events", os.path.join(ROOT, "library", "unifi_controller_events.py"))
+events = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(events)
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+BACKPRESSURE_FRAMES = 20000
+BACKPRESSURE_PADDING = "x" * 4096
+
+# Frames the backpressure feed managed to send, and the flag telling it to stop
+backpressure = {"sent": 0, "stop": False}
+
+
+def frame(message, data):
+    payload = json.dumps({"meta": {"rc": "ok", "message": message}, "data": data}).encode('utf-8')
+    if len(payload) < 126:
+        header = struct.pack("!BB", 0x81, len(payload))
+    elif len(payload) < 65536:
+        header = struct.pack("!BBH", 0x81, 126, len(payload))
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, len(payload))
+    return header + payload
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"meta": {"rc": "ok"}, "data": []}).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Set-Cookie", "unifises=standin; Path=/")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if "unifises=standin" not in (self.headers.get("Cookie") or ""):
+            self.send_error(401)
+            return
+        if self.path.split("/")[3] not in FEEDS:
+            self.send_error(404)
+            return
+        accept = base64.b64encode(hashlib.sha1((self.headers["Sec-WebSocket-Key"] + WEBSOCKET_GUID).encode('utf-8')).digest())
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept.decode('ascii'))
+        self.end_headers()
+        self.wfile.flush()
+        scenario = self.path.split("/")[3]
+        try:
+            getattr(self, "feed_" + scenario)()
+        except (IOError, OSError):
+            pass
+        self.close_connection = True
+
+    # Reads (masked) client frames until the close frame, then answers it the way a controller does
+    def wait_for_close(self):
+        while True:
+            opcode, length = struct.unpack("!BB", self.rfile.read(2))
+            length &= 0x7f
+            if length == 126:
+                length = struct.unpack("!H", self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self.rfile.read(8))[0]
+            mask = bytearray(self.rfile.read(4))
+            payload = bytearray(self.rfile.read(length))
+            if opcode & 0x0f == 0x8:
+                payload = bytes(bytearray(byte ^ mask[i % 4] for i, byte in enumerate(payload)))
+                self.wfile.write(struct.pack("!BB", 0x88, len(payload)) + payload)
+                return
+
+    def feed_match(self):
+        for i in range(50):
+            self.wfile.write(frame("sta:sync", [{"key": "EVT_WU_Connected", "n": i}]))
+            self.wfile.write(frame("events", [{"key": "EVT_WU_Connected" if i == 30 else "EVT_WU_Roam", "n": i}]))
+        self.wait_for_close()
+
+    def feed_timeout(self):
+        for i in range(5):
+            self.wfile.write(frame("events", [{"key": "EVT_WU_Roam", "n": i}]))
+        self.wait_for_close()
+
+    def feed_max_events(self):
+        for i in range(100):
+            self.wfile.write(frame("alarm", [{"key": "EVT_AP_Lost_Contact", "n": i}]))
+        self.wait_for_close()
+
+    def feed_backpressure(self):
+        for i in range(BACKPRESSURE_FRAMES):
+            if backpressure["stop"]:
+                break
+            self.wfile.write(frame("events", [{"key": "EVT_WU_Roam", "n": i, "padding": BACKPRESSURE_PADDING}]))
+            backpressure["sent"] = i + 1
+        self.wait_for_close()
+
+
+FEEDS = [name[len("feed_"):] for name in dir(StandInHandler) if name.startswith("feed_")]
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def login(url, scenario):
+    client = UniFiClient(url, "admin", "changeme", scenario)
+    if client.login()['status_code'] != 200:
+        raise AssertionError("login to the stand-in failed")
+    return client
+
+
+def stream(url, scenario, **options):
+    client = login(url, scenario)
+    data = {"controller_baseURL": url, "controller_site": scenario, "output_path": None, "match": None, "timeout": 10,
+            "max_events": None, "buffer_size": 1000, "message_types": ['events', 'alarm']}
+    data.update(options)
+    started = time.time()
+    result = events.stream_events(client, data)
+    return result, time.time() - started
+
+
+# Runs the reader thread with nobody draining its buffer, returns (frames sent once the feed stalled, buffered events)
+def stall(url):
+    client = login(url, "backpressure")
+    cookie = "; ".join([name + "=" + value for name, value in client.cookies().items()])
+    ws = events.websocket.create_connection(events.events_url(url, "backpressure"), cookie=cookie, timeout=1)
+    buffer = events.queue.Queue(maxsize=4)
+    stop = threading.Event()
+    reader = threading.Thread(target=events.read_events, args=(ws, buffer, ['events', 'alarm'], stop))
+    reader.daemon = True
+    reader.start()
+    stalled = -1
+    while stalled != backpressure["sent"]:
+        stalled = backpressure["sent"]
+        time.sleep(1)
+    buffered = buffer.qsize()
+    backpressure["stop"] = True
+    stop.set()
+    reader.join(5)
+    ws.close()
+    return stalled, buffered
+
+
+def check(name, condition, detail):
+    print("%-14s %-4s %s" % (name, "ok" if condition else "FAIL", detail))
+    return condition
+
+
+def main():
+    server = StandInServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = "http://127.0.0.1:%d" % server.server_address[1]
+    output = tempfile.NamedTemporaryFile(suffix=".ndjson", delete=False)
+    output.close()
+    passed = True
+
+    (is_error, changed, result), elapsed = stream(url, "match", match={"key": "EVT_WU_Connected"})
+    passed &= check("match", not is_error and result["status"] == "matched" and result["count"] == 31 and result["event"]["n"] == 30, result)
+
+    (is_error, changed, result), elapsed = stream(url, "timeout", timeout=2)
+    passed &= check("timeout", not is_error and result["status"] == "timeout" and result["count"] == 5 and 2 <= elapsed < 4,
+                    "%s after %.1fs" % (result, elapsed))
+
+    (is_error, changed, result), elapsed = stream(url, "max_events", max_events=10, output_path=output.name)
+    with open(output.name) as ndjson:
+        lines = [json.loads(line)["n"] for line in ndjson]
+    passed &= check("max_events", changed and result["status"] == "max_events" and result["count"] == 10 and lines == list(range(10)),
+                    "%s, %d lines written" % (result, len(lines)))
+
+    stalled, buffered = stall(url)
+    passed &= check("backpressure", buffered == 4 and stalled < BACKPRESSURE_FRAMES,
+                    "stand-in blocked after %d of %d frames, %d events buffered" % (stalled, BACKPRESSURE_FRAMES, buffered))
+
+    (is_error, changed, result), elapsed = stream(url, "missing")
+    passed &= check("rejected", is_error and result["status"] == 404, result)
+
+    threads = threading.active_count()
+    (is_error, changed, result), elapsed = stream(url, "timeout", output_path=os.path.join(output.name, "events.ndjson"))
+    passed &= check("output_path", is_error and result["status"] is None and threading.active_count() == threads,
+                    "%s, %d threads left behind" % (result, threading.active_count() - threads))
+
+    os.unlink(output.name)
+    server.shutdown()
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
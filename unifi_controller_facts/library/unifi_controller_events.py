@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+DOCUMENTATION = '''
+---
+module: unifi_controller_events
+short_description: Stream real-time events from your UniFi Controllers with Ansible
+author: "Ken Moini (@kenmoini)"
+requirements:
+  - requests
+  - websocket-client
+'''
+
+EXAMPLES = '''
+- name: Record controller events to an NDJSON file for 5 minutes
+  unifi_controller_events:
+    controller_baseURL: "https://127.0.0.1:8443"
+    controller_username: "admin"
+    controller_password: "changeme"
+    controller_site: "default"
+    output_path: "/var/log/unifi/events.ndjson"
+    timeout: 300
+  register: returnedData
+
+- name: Wait until a client connects to the guest network
+  unifi_controller_events:
+    controller_baseURL: "https://192.168.1.224:8443"
+    controller_username: "admin"
+    controller_password: "changeme"
+    controller_site: "default"
+    match:
+      key: "EVT_WU_Connected"
+      ssid: "Guests"
+    timeout: 600
+  register: returnedData
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.unifi import UniFiClient
+import json
+import queue
+import ssl
+import threading
+import time
+
+try:
+    import websocket
+    HAS_WEBSOCKET = True
+except ImportError:
+    HAS_WEBSOCKET = False
+
+# Sentinel pushed onto the buffer by the reader thread once the socket is closed
+STREAM_CLOSED = object()
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: events_url
+# ---------------------------------------------------------------------------------------------------------------------
+# Builds the WebSocket URL of the events feed for a site
+# required parameter <controller_baseURL>   = (str) The hostname and port of the target controller
+# required parameter <controller_site>      = (str) The site to subscribe to
+#
+# NOTES:
+# - https:// becomes wss://, http:// becomes ws://
+# ---------------------------------------------------------------------------------------------------------------------
+def events_url(controller_baseURL, controller_site):
+    baseURL = controller_baseURL.rstrip("/")
+    if baseURL.startswith("https://"):
+        baseURL = "wss://" + baseURL[len("https://"):]
+    elif baseURL.startswith("http://"):
+        baseURL = "ws://" + baseURL[len("http://"):]
+    return baseURL + "/wss/s/" + controller_site + "/events"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: event_matches
+# ---------------------------------------------------------------------------------------------------------------------
+# returns True when every key/value pair of <match> is present in the event
+# required parameter <event> = (dict) A single event object from the feed
+# required parameter <match> = (dict) The key/value pairs to look for, values are compared as strings
+# ---------------------------------------------------------------------------------------------------------------------
+def event_matches(event, match):
+    for key, value in match.items():
+        if key not in event or str(event[key]) != str(value):
+            return False
+    return True
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: read_events
+# ---------------------------------------------------------------------------------------------------------------------
+# Reader thread body, receives frames from the WebSocket and puts the decoded events on the buffer
+# required parameter <ws>            = (WebSocket) The connected WebSocket
+# required parameter <buffer>        = (Queue) The bounded buffer shared with the writer
+# required parameter <message_types> = (list) meta.message values to keep, an empty list keeps everything
+# required parameter <stop>          = (Event) Set by the writer to ask the reader to stop
+#
+# NOTES:
+# - the put on a full buffer blocks, so the reader stops draining the socket and TCP flow control pushes back on
+#   the controller instead of memory growing without bound
+# ---------------------------------------------------------------------------------------------------------------------
+def read_events(ws, buffer, message_types, stop):
+    try:
+        while not stop.is_set():
+            try:
+                frame = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                continue
+            if not frame:
+                break
+            try:
+                decoded = json.loads(frame)
+            except ValueError:
+                continue
+            message = decoded.get('meta', {}).get('message')
+            if message_types and message not in message_types:
+                continue
+            for event in decoded.get('data', []):
+                while not stop.is_set():
+                    try:
+                        buffer.put((message, event), timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+    except (websocket.WebSocketException, ssl.SSLError, OSError):
+        pass
+    finally:
+        while True:
+            try:
+                buffer.put(STREAM_CLOSED, timeout=1)
+                break
+            except queue.Full:
+                if stop.is_set():
+                    break
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: stream_events - Subscribe to the site events feed
+# ---------------------------------------------------------------------------------------------------------------------
+# Streams events until the timeout expires, <max_events> have been received, or an event matches <match>
+# required parameter <client>        = (UniFiClient) A logged in client, its session cookie authenticates the WebSocket
+# optional parameter <output_path>   = file to append the received events to, one JSON object per line
+# optional parameter <match>         = dict of key/value pairs, stop as soon as an event contains all of them
+# optional parameter <timeout>       = seconds to stream for (default = 60)
+# optional parameter <max_events>    = stop after this many events
+# optional parameter <buffer_size>   = number of events held in memory between the socket and the writer (default = 1000)
+# optional parameter <message_types> = meta.message values to keep, [] keeps the sync pushes too (default = ['events', 'alarm'])
+#
+# Returns
+#  (is_error, has_changed, dict(
+#   "status"        => (str) "matched", "timeout", "max_events" or "closed",
+#   "count"         => (int) Number of events received,
+#   "event"         => (dict) The matching event, if any
+#  ))
+#  or (True, False, dict("status" => (int) HTTP status or None, "data" => (str) error)) when the output file cannot be
+#  opened or the controller refuses the WebSocket
+# ---------------------------------------------------------------------------------------------------------------------
+def stream_events(client, data):
+    # Open the output first, a bad path must not leave a connected socket and a running reader behind
+    output = None
+    if data['output_path'] is not None:
+        try:
+            output = open(data['output_path'], "a")
+        except (IOError, OSError) as e:
+            return True, False, {"status": None, "data": str(e)}
+
+    cookie = "; ".join([name + "=" + value for name, value in client.cookies().items()])
+    try:
+        ws = websocket.create_connection(events_url(data['controller_baseURL'], data['controller_site']),
+                                         header=["Origin: " + data['controller_baseURL']],
+                                         cookie=cookie, sslopt={"cert_reqs": ssl.CERT_NONE, "check_hostname": False},
+                                         timeout=1)
+    except (websocket.WebSocketException, ssl.SSLError, OSError) as e:
+        if output is not None:
+            output.close()
+        return True, False, {"status": getattr(e, 'status_code', None), "data": str(e)}
+
+    buffer = queue.Queue(maxsize=data['buffer_size'])
+    stop = threading.Event()
+    reader = threading.Thread(target=read_events, args=(ws, buffer, data['message_types'], stop))
+    reader.daemon = True
+    reader.start()
+
+    count = 0
+    matched = None
+    status = "timeout"
+    deadline = time.time() + data['timeout']
+    try:
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = buffer.get(timeout=min(remaining, 1))
+            except queue.Empty:
+                continue
+            if item is STREAM_CLOSED:
+                status = "closed"
+                break
+            event = item[1]
+            count += 1
+            if output is not None:
+                output.write(json.dumps(event, separators=(',', ':')) + "\n")
+            if data['match'] is not None and event_matches(event, data['match']):
+                status = "matched"
+                matched = event
+                break
+            if data['max_events'] is not None and count >= data['max_events']:
+                status = "max_events"
+                break
+    finally:
+        stop.set()
+        if output is not None:
+            output.close()
+        ws.close()
+        reader.join(5)
+
+    if data['match'] is not None and matched is None:
+        return True, False, {"status": status, "count": count, "event": None}
+    return False, count > 0 and output is not None, {"status": status, "count": count, "event": matched}
+
+def main():
+
+    fields = {
+        "controller_username": {"required": True, "type": "str"},
+        "controller_password": {"required": True, "type": "str", "no_log": True},
+        "controller_baseURL": {"required": True, "type": "str"},
+        "controller_site": {"required": False, "type": "str", "default": "default"},
+        "output_path": {"required": False, "type": "path", "default": None},
+        "match": {"required": False, "type": "dict", "default": None},
+        "timeout": {"required": False, "type": "int", "default": 60},
+        "max_events": {"required": False, "type": "int", "default": None},
+        "buffer_size": {"required": False, "type": "int", "default": 1000},
+        "message_types": {"required": False, "type": "list", "default": ['events', 'alarm']},
+    }
+
+    module = AnsibleModule(argument_spec=fields, supports_check_mode=False)
+
+    if not HAS_WEBSOCKET:
+        module.fail_json(msg="The websocket-client python library is required for this module")
+
+    client = UniFiClient(module.params['controller_baseURL'], module.params['controller_username'], module.params['controller_password'], module.params['controller_site'])
+    fireLogin = client.login()
+    if fireLogin['status_code'] == 200:
+        is_error, has_changed, result = stream_events(client, module.params)
+    else:
+        res = {"status": fireLogin['status_code'], "data": fireLogin['data']}
+        is_error, has_changed, result = (True, False, res)
+
+    if not is_error:
+        module.exit_json(changed=has_changed, meta=result)
+    else:
+        module.fail_json(msg="Error", meta=result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------------------------------------------------
+# UniFi Controller API client shared by the unifi_controller_* modules
+# ---------------------------------------------------------------------------------------------------------------------
+# Modules import this as ansible.module_utils.unifi, lookup/inventory plugins and standalone scripts can put this
+# directory on sys.path and import it as unifi.  Nothing in here depends on Ansible.
+#
+# Every query the modules support is described once in the ENDPOINTS table below, the sync UniFiClient here and the
+# asyncio AsyncUniFiClient in unifi_async.py both build their requests from it.
+#
+# Modules run once per task per host, so this file only imports the standard library up front.  The HTTP library is
+# imported by the transport that needs it, when the client is created.
+# ---------------------------------------------------------------------------------------------------------------------
+
+import json
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+DEFAULT_SITE = "default"
+
+SITE_STATS_ATTRS = ['bytes', 'wan-tx_bytes', 'wan-rx_bytes', 'wlan_bytes', 'num_sta', 'lan-num_sta', 'wlan-num_sta', 'time']
+AP_STATS_ATTRS = ['bytes', 'num_sta', 'time']
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: UniFiError
+# ---------------------------------------------------------------------------------------------------------------------
+# Raised by UniFiClient.query() when the controller answers with meta.rc != "ok"
+# ---------------------------------------------------------------------------------------------------------------------
+class UniFiError(Exception):
+    def __init__(self, status_code, text):
+        Exception.__init__(self, "UniFi controller returned HTTP %s: %s" % (status_code, text))
+        self.status_code = status_code
+        self.text = text
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: UniFiLoginError
+# ---------------------------------------------------------------------------------------------------------------------
+# Raised by UniFiClient.request(relogin=True) when logging in fails, <result> is the login() result
+# ---------------------------------------------------------------------------------------------------------------------
+class UniFiLoginError(UniFiError):
+    def __init__(self, result):
+        Exception.__init__(self, "UniFi controller login failed with HTTP %s: %s" % (result['status_code'], result['data']))
+        self.status_code = result['status_code']
+        self.text = json.dumps(result['data'])
+        self.result = result
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Parameter builders
+# ---------------------------------------------------------------------------------------------------------------------
+# Each builder returns a function taking the query data dict (the module parameters) and returning the query string
+# parameters to send.  Defaults that depend on the current time are computed when the request is made.
+# ---------------------------------------------------------------------------------------------------------------------
+def _optional(data, key):
+    value = data.get(key)
+    if isinstance(value, str):
+        value = value.strip()
+    return value
+
+def within_hours(default, required=True):
+    def build(data):
+        if data.get('since') is not None:
+            return {"within": int(data['since'])}
+        if required:
+            return {"within": default}
+        return {}
+    return build
+
+def epoch_range(span, milliseconds=False, extra=None, mac_key=None):
+    def build(data):
+        if data.get('end_epoch') is not None:
+            end = int(data['end_epoch'])
+        elif milliseconds:
+            end = int(time.time() * 1000)
+        else:
+            end = int(time.time())
+        if data.get('start_epoch') is not None:
+            start = int(data['start_epoch'])
+        else:
+            start = int(end - (span * 1000 if milliseconds else span))
+        params = {"start": start, "end": end}
+        if extra is not None:
+            params.update(extra)
+        if mac_key is not None and _optional(data, mac_key) is not None:
+            params["mac"] = _optional(data, mac_key)
+        return params
+    return build
+
+def fixed(params):
+    def build(data):
+        return dict(params)
+    return build
+
+def created_time(data):
+    if data.get('created_time') is not None:
+        return {"created_time": data['created_time']}
+    return {}
+
+def event_paging(data):
+    return {
+        "_sort": "-time",
+        "within": int(data['since']) if data.get('since') is not None else 720,
+        "_start": int(data['start_num']) if data.get('start_num') is not None else 0,
+        "_limit": int(data['limit_num']) if data.get('limit_num') is not None else 3000,
+    }
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: Endpoint
+# ---------------------------------------------------------------------------------------------------------------------
+# One row of the endpoint table
+# required parameter <path>   = (str) Path below /api/s/<site>/, or below the controller root when site is False
+# optional parameter <site>   = (bool) Whether the path is site scoped (default = True)
+# optional parameter <params> = (func) Parameter builder, see above
+# optional parameter <suffix> = (str) Name of a data key appended to the path when set, e.g. a MAC address or _id
+# ---------------------------------------------------------------------------------------------------------------------
+class Endpoint(object):
+    __slots__ = ('path', 'site', 'params', 'suffix')
+
+    def __init__(self, path, site=True, params=None, suffix=None):
+        self.path = path
+        self.site = site
+        self.params = params
+        self.suffix = suffix
+
+    def url(self, controller_baseURL, controller_site, data):
+        if self.site:
+            url = controller_baseURL + "/api/s/" + controller_site + "/" + self.path
+        else:
+            url = controller_baseURL + self.path
+        if self.suffix is not None and _optional(data, self.suffix) is not None:
+            url += str(_optional(data, self.suffix))
+        return url
+
+    def build_params(self, data):
+        if self.params is None:
+            return {}
+        return dict((key, value) for key, value in self.params(data).items() if value is not None)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Endpoint table
+# ---------------------------------------------------------------------------------------------------------------------
+# Optional data keys used by the builders: since, start_num, limit_num, start_epoch, end_epoch, created_time,
+# device_mac, client_mac, network_id, wlan_id
+# Endpoints marked [UNTESTED] / [404 ERROR] / [400 ERROR] carry over the notes from the original module functions.
+# ---------------------------------------------------------------------------------------------------------------------
+ENDPOINTS = {
+    # Clients
+    'list_online_clients': Endpoint("stat/sta/", suffix='client_mac'),
+    'list_clients': Endpoint("stat/sta/", suffix='client_mac'),
+    'list_guests': Endpoint("stat/guest", params=within_hours(8760)),                                   # [UNTESTED]
+    'list_users': Endpoint("list/user"),
+    'list_user_groups': Endpoint("list/usergroup"),
+    'stat_all_users': Endpoint("stat/alluser", params=lambda data: dict(within_hours(8760)(data), type="all", conn="all")),
+    'stat_authorizations': Endpoint("stat/authorization", params=epoch_range(7*24*3600)),
+    'stat_sessions': Endpoint("stat/session", params=epoch_range(7*24*3600, extra={"type": "all"}, mac_key='client_mac')),
+    # Devices
+    'list_devices': Endpoint("stat/device/", suffix='device_mac'),
+    'list_wlan_groups': Endpoint("list/wlangroup"),
+    'list_rouge_access_points': Endpoint("stat/rogueap", params=within_hours(24)),
+    'list_known_rogue_access_points': Endpoint("rest/rogueknown"),
+    'list_tags': Endpoint("rest/tag"),                                                                   # 5.5.X+
+    # Stats, epochs in milliseconds
+    'five_minute_site_stats': Endpoint("stat/report/5minutes.site", params=epoch_range(12*3600, True, {"attrs": SITE_STATS_ATTRS})),      # [UNTESTED]
+    'hourly_site_stats': Endpoint("stat/report/hourly.site", params=epoch_range(7*24*3600, True, {"attrs": SITE_STATS_ATTRS})),          # [UNTESTED]
+    'daily_site_stats': Endpoint("stat/report/daily.site", params=epoch_range(52*7*24*3600, True, {"attrs": SITE_STATS_ATTRS})),         # [UNTESTED]
+    'all_sites_stats': Endpoint("/api/stat/sites", site=False),                                                                            # 5.2.9+
+    'five_minute_access_point_stats': Endpoint("stat/report/5minutes.ap", params=epoch_range(12*3600, True, {"attrs": AP_STATS_ATTRS}, 'device_mac')),   # [UNTESTED]
+    'hourly_access_point_stats': Endpoint("stat/report/hourly.ap", params=epoch_range(7*24*3600, True, {"attrs": AP_STATS_ATTRS}, 'device_mac')),       # [UNTESTED]
+    'daily_access_point_stats': Endpoint("stat/report/daily.ap", params=epoch_range(7*24*3600, True, {"attrs": AP_STATS_ATTRS}, 'device_mac')),         # [UNTESTED]
+    'five_minute_site_dashboard_metrics': Endpoint("stat/dashboard", params=fixed({"scale": "5minutes"})),
+    'hourly_site_dashboard_metrics': Endpoint("stat/dashboard"),
+    'site_health_metrics': Endpoint("stat/health"),
+    'port_forwarding_stats': Endpoint("stat/portforward"),
+    'dpi_stats': Endpoint("stat/dpi"),
+    # Hotspot
+    'stat_vouchers': Endpoint("stat/voucher", params=created_time),
+    'stat_payments': Endpoint("stat/payment", params=within_hours(None, required=False)),               # [UNTESTED]
+    'list_hotspot_operators': Endpoint("rest/hotspotop"),                                                # [UNTESTED]
+    # Configuration
+    'list_sites': Endpoint("/api/self/sites", site=False),
+    'sysinfo': Endpoint("stat/sysinfo"),
+    'list_site_settings': Endpoint("get/setting"),
+    'list_admins_for_current_site': Endpoint("cmd/sitemgr", params=fixed({"cmd": "get-admins"})),       # [404 ERROR]
+    'list_admins_for_all_sites': Endpoint("/api/stat/admin", site=False),
+    'list_wlan_configuration': Endpoint("rest/wlanconf/", suffix='wlan_id'),
+    'list_current_channels': Endpoint("stat/current-channel"),
+    'list_voip_extensions': Endpoint("list/extension"),                                                  # [400 ERROR]
+    'list_network_configuration': Endpoint("rest/networkconf/", suffix='network_id'),
+    'list_port_configuration': Endpoint("list/portconf"),                                                # [UNTESTED]
+    'list_port_forwarding_rules': Endpoint("list/portforward"),                                          # [UNTESTED]
+    'list_firewall_groups': Endpoint("rest/firewallgroup"),                                              # [UNTESTED]
+    'dynamic_dns_configuration': Endpoint("list/dynamicdns"),                                            # [UNTESTED]
+    'list_country_codes': Endpoint("stat/ccode"),
+    'list_auto_backups': Endpoint("cmd/backup", params=fixed({"cmd": "list-backups"})),                 # [404 ERROR]
+    'list_radius_profiles': Endpoint("rest/radiusprofile"),                                              # 5.5.19+ [UNTESTED]
+    'list_radius_accounts': Endpoint("rest/account"),                                                    # 5.5.19+ [UNTESTED]
+    # Messages
+    'list_alarms': Endpoint("list/alarm"),                                                               # [UNTESTED]
+    'list_events': Endpoint("stat/event", params=event_paging),                                          # [UNTESTED]
+}
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: decode_response
+# ---------------------------------------------------------------------------------------------------------------------
+# Decodes a controller response body
+# required parameter <status_code> = (int) The HTTP Status Code returned
+# required parameter <text>        = (str) The response body
+#
+# Returns the "data" member, raises UniFiError when meta.rc is not "ok" or the body is not JSON
+# ---------------------------------------------------------------------------------------------------------------------
+def decode_response(status_code, text):
+    try:
+        decoded_response = json.loads(text)
+    except ValueError:
+        raise UniFiError(status_code, text)
+    if decoded_response.get('meta', {}).get('rc') != "ok":
+        raise UniFiError(status_code, text)
+    return decoded_response.get('data')
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: SimpleResponse
+# ---------------------------------------------------------------------------------------------------------------------
+# The parts of a requests response object the modules use, returned by HttpClientTransport
+# ---------------------------------------------------------------------------------------------------------------------
+class SimpleResponse(object):
+    __slots__ = ('status_code', 'text')
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: RequestsTransport
+# ---------------------------------------------------------------------------------------------------------------------
+# Default transport, a requests session with its pool of keep-alive connections.  Safe to share between threads.
+# ---------------------------------------------------------------------------------------------------------------------
+class RequestsTransport(object):
+
+    def __init__(self, controller_baseURL, verify=False, timeout=60):
+        import requests
+        self.verify = verify
+        self.timeout = timeout
+        self.session = requests.session()
+        self.session.headers.update({'referer': controller_baseURL + "/login"})
+
+    def get(self, url, params=None):
+        return self.session.get(url, params=params, verify=self.verify, timeout=self.timeout)
+
+    def post(self, url, body):
+        return self.session.post(url, body, verify=self.verify, timeout=self.timeout)
+
+    def cookies(self):
+        return dict(self.session.cookies.items())
+
+    def close(self):
+        self.session.close()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: HttpClientTransport
+# ---------------------------------------------------------------------------------------------------------------------
+# Lightweight transport on the standard library http.client, for simple queries where importing requests costs more
+# than the query itself.  Keeps a single keep-alive connection to the controller and reconnects when the controller
+# closes it.  Not safe to share between threads, give each thread its own client.
+# ---------------------------------------------------------------------------------------------------------------------
+class HttpClientTransport(object):
+
+    def __init__(self, controller_baseURL, verify=False, timeout=60):
+        parts = urlsplit(controller_baseURL)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.verify = verify
+        self.timeout = timeout
+        self.referer = controller_baseURL + "/login"
+        self.cookie_jar = {}
+        self.connection = None
+
+    def _connect(self):
+        import http.client
+        if self.scheme == "https":
+            import ssl
+            if self.verify:
+                context = ssl.create_default_context()
+            else:
+                context = ssl._create_unverified_context()
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _store_cookies(self, response):
+        for header in response.msg.get_all('Set-Cookie') or []:
+            name, _, value = header.split(";", 1)[0].partition("=")
+            name = name.strip()
+            if value and "max-age=0" not in header.lower():
+                self.cookie_jar[name] = value.strip()
+            else:
+                self.cookie_jar.pop(name, None)
+
+    def _request(self, method, url, body=None, headers=None):
+        import http.client
+        parts = urlsplit(url)
+        target = parts.path + ("?" + parts.query if parts.query else "")
+        request_headers = {'Referer': self.referer, 'Accept-Encoding': "gzip"}
+        if self.cookie_jar:
+            request_headers['Cookie'] = "; ".join([name + "=" + value for name, value in self.cookie_jar.items()])
+        if headers:
+            request_headers.update(headers)
+        # A kept-alive connection the controller already closed fails on first use, retry once on a fresh one.  Any
+        # failure, including a malformed response, leaves the connection mid-request, so it is always dropped.
+        for attempt in (0, 1):
+            if self.connection is None:
+                self.connection = self._connect()
+            try:
+                self.connection.request(method, target, body, request_headers)
+                response = self.connection.getresponse()
+                payload = response.read()
+                break
+            except (OSError, http.client.HTTPException):
+                self.close()
+                if attempt:
+                    raise
+        self._store_cookies(response)
+        if response.getheader('Content-Encoding') == "gzip":
+            import zlib
+            payload = zlib.decompress(payload, 16 + zlib.MAX_WBITS)
+        if response.getheader('Connection', "").lower() == "close":
+            self.connection.close()
+            self.connection = None
+        return SimpleResponse(response.status, payload.decode('utf-8'))
+
+    def get(self, url, params=None):
+        if params:
+            url += ("&" if "?" in url else "?") + urlencode(params, doseq=True)
+        return self._request("GET", url)
+
+    def post(self, url, body):
+        return self._request("POST", url, body, {'Content-Type': "application/json"})
+
+    def cookies(self):
+        return dict(self.cookie_jar)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+TRANSPORTS = {
+    'requests': RequestsTransport,
+    'http.client': HttpClientTransport,
+}
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: UniFiClient
+# ---------------------------------------------------------------------------------------------------------------------
+# Synchronous client, one transport (and so one set of keep-alive connections and one login cookie) per instance.
+# With request(relogin=True) the client logs itself in and back in when the session expires, safe to share between
+# threads when the transport is.
+# required parameter <controller_baseURL>   = (str) The hostname and port of the target controller
+# required parameter <controller_username>  = (str) The username to authenticate as
+# required parameter <controller_password>  = (str) The password to authenticate with
+# optional parameter <controller_site>      = (str) The default site for site scoped queries (default = "default")
+# optional parameter <verify>               = (bool) Verify the controller TLS certificate (default = False)
+# optional parameter <transport>            = (str) 'requests' (default) or 'http.client', see TRANSPORTS
+# optional parameter <timeout>              = (int) Seconds to wait for the controller to connect or answer (default = 60)
+#
+# Usage
+#  client = UniFiClient("https://127.0.0.1:8443", "admin", "changeme")
+#  client.login()
+#  sites = client.query('list_sites')
+#  devices = client.query('list_devices', site="branch1")
+# ---------------------------------------------------------------------------------------------------------------------
+class UniFiClient(object):
+
+    def __init__(self, controller_baseURL, controller_username, controller_password, controller_site=DEFAULT_SITE, verify=False, transport='requests', timeout=60):
+        self.controller_baseURL = controller_baseURL.rstrip("/")
+        self.controller_username = controller_username
+        self.controller_password = controller_password
+        self.controller_site = controller_site
+        self.verify = verify
+        self.transport = TRANSPORTS[transport](self.controller_baseURL, verify, timeout)
+        self.logged_in = False
+        self.generation = 0
+        self.login_lock = threading.Lock()
+
+    # Logs in the user and establishes the cookie, returns dict(status_code, data) like the original unifi_login
+    def login(self):
+        l = self.transport.post(self.controller_baseURL + "/api/login",
+                                json.dumps({"username": self.controller_username, "password": self.controller_password}))
+        self.logged_in = l.status_code == 200
+        self.generation += 1
+        return {"status_code": l.status_code, "data": l.json()}
+
+    # Logs in unless another thread already did so since <generation> was read, so a burst of expired requests
+    # logs in once, raises UniFiLoginError when the login fails
+    def _relogin(self, generation):
+        with self.login_lock:
+            if self.logged_in and self.generation != generation:
+                return
+            result = self.login()
+        if result['status_code'] != 200:
+            raise UniFiLoginError(result)
+
+    # Logs the user out, destroys the session
+    def logout(self):
+        return self.transport.get(self.controller_baseURL + "/logout")
+
+    # Session cookies as a dict, e.g. to authenticate the events WebSocket
+    def cookies(self):
+        return self.transport.cookies()
+
+    # Raw GET against the controller, <path> is relative to the controller root
+    def get(self, path, params=None):
+        return self.transport.get(self.controller_baseURL + path, params)
+
+    # Issues the request for <query> from the endpoint table and returns the response object.  With <relogin> the client
+    # logs in first when it is not logged in, and logs in again and retries once when the session expired (HTTP 401).
+    def request(self, query, data=None, site=None, relogin=False):
+        if query not in ENDPOINTS:
+            raise KeyError("Unknown UniFi query: %s" % query)
+        endpoint = ENDPOINTS[query]
+        data = data or {}
+        url = endpoint.url(self.controller_baseURL, site or self.controller_site, data)
+        if not relogin:
+            return self.transport.get(url, endpoint.build_params(data))
+        generation = self.generation
+        if not self.logged_in:
+            self._relogin(generation)
+            generation = self.generation
+        response = self.transport.get(url, endpoint.build_params(data))
+        if response.status_code == 401:
+            self._relogin(generation)
+            response = self.transport.get(url, endpoint.build_params(data))
+        return response
+
+    # Issues the request for <query> and returns the decoded "data" member, raises UniFiError on failure
+    def query(self, query, data=None, site=None):
+        response = self.request(query, data, site)
+        return decode_response(response.status_code, response.text)
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------------------------------------------------
+# asyncio transport for the UniFi Controller API client
+# ---------------------------------------------------------------------------------------------------------------------
+# Builds its requests from the same ENDPOINTS table as UniFiClient in unifi.py.  One AsyncUniFiClient holds one
+# aiohttp session per controller, so a single event loop can drive many sites and queries over a shared pool of
+# keep-alive connections.
+#
+# Requires Python 3 and the aiohttp library.
+#
+# Usage
+#  async def collect():
+#      async with AsyncUniFiClient("https://127.0.0.1:8443", "admin", "changeme") as client:
+#          await client.login()
+#          sites = await client.query('list_sites')
+#          return await gather_queries(client, [('list_devices', site['name'], None) for site in sites])
+# ---------------------------------------------------------------------------------------------------------------------
+
+import asyncio
+import json
+
+try:
+    from ansible.module_utils.unifi import DEFAULT_SITE, ENDPOINTS, UniFiError, decode_response
+except ImportError:
+    from unifi import DEFAULT_SITE, ENDPOINTS, UniFiError, decode_response
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: flatten_params
+# ---------------------------------------------------------------------------------------------------------------------
+# aiohttp does not accept list values in a params dict, expand them into repeated keys the way requests does
+# ---------------------------------------------------------------------------------------------------------------------
+def flatten_params(params):
+    flattened = []
+    for key, value in params.items():
+        if isinstance(value, (list, tuple)):
+            flattened.extend((key, str(item)) for item in value)
+        else:
+            flattened.append((key, str(value)))
+    return flattened
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: AsyncUniFiClient
+# ---------------------------------------------------------------------------------------------------------------------
+# asyncio client, see UniFiClient for the parameters
+# optional parameter <limit> = (int) Maximum number of simultaneous connections to the controller (default = 20)
+# ---------------------------------------------------------------------------------------------------------------------
+class AsyncUniFiClient(object):
+
+    def __init__(self, controller_baseURL, controller_username, controller_password, controller_site=DEFAULT_SITE, verify=False, limit=20):
+        if not HAS_AIOHTTP:
+            raise ImportError("The aiohttp python library is required for AsyncUniFiClient")
+        self.controller_baseURL = controller_baseURL.rstrip("/")
+        self.controller_username = controller_username
+        self.controller_password = controller_password
+        self.controller_site = controller_site
+        self.verify = verify
+        self.limit = limit
+        self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _session(self):
+        if self.session is None:
+            # unsafe=True keeps the login cookie when the controller is addressed by IP
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit, ssl=None if self.verify else False),
+                                                 cookie_jar=aiohttp.CookieJar(unsafe=True),
+                                                 headers={'referer': self.controller_baseURL + "/login"})
+        return self.session
+
+    async def login(self):
+        payload = json.dumps({"username": self.controller_username, "password": self.controller_password})
+        async with self._session().post(self.controller_baseURL + "/api/login", data=payload) as l:
+            return {"status_code": l.status, "data": await l.json(content_type=None)}
+
+    async def logout(self):
+        async with self._session().get(self.controller_baseURL + "/logout") as l:
+            return l.status
+
+    def cookies(self):
+        return dict((cookie.key, cookie.value) for cookie in self._session().cookie_jar)
+
+    # Raw GET against the controller, returns (status_code, text)
+    async def get(self, path, params=None):
+        async with self._session().get(self.controller_baseURL + path, params=flatten_params(params or {})) as response:
+            return response.status, await response.text()
+
+    # Issues the request for <query> from the endpoint table and returns (status_code, text)
+    async def request(self, query, data=None, site=None):
+        if query not in ENDPOINTS:
+            raise KeyError("Unknown UniFi query: %s" % query)
+        endpoint = ENDPOINTS[query]
+        data = data or {}
+        url = endpoint.url(self.controller_baseURL, site or self.controller_site, data)
+        async with self._session().get(url, params=flatten_params(endpoint.build_params(data))) as response:
+            return response.status, await response.text()
+
+    # Issues the request for <query> and returns the decoded "data" member, raises UniFiError on failure
+    async def query(self, query, data=None, site=None):
+        status_code, text = await self.request(query, data, site)
+        return decode_response(status_code, text)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: gather_queries
+# ---------------------------------------------------------------------------------------------------------------------
+# Runs many queries concurrently on one client
+# required parameter <client>      = (AsyncUniFiClient) A logged in client
+# required parameter <queries>     = (list) (query, site, data) tuples, site and data may be None
+# optional parameter <concurrency> = (int) Maximum number of queries in flight (default = the client connection limit)
+#
+# Returns a list in the order of <queries>, each item the decoded data or the exception raised for that query
+# (UniFiError, aiohttp.ClientError or asyncio.TimeoutError), so one unreachable site does not lose the other results
+# ---------------------------------------------------------------------------------------------------------------------
+async def gather_queries(client, queries, concurrency=None):
+    semaphore = asyncio.Semaphore(concurrency or client.limit)
+
+    async def run(query, site, data):
+        async with semaphore:
+            try:
+                return await client.query(query, data, site)
+            except (UniFiError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                return e
+
+    return await asyncio.gather(*[run(query, site, data) for query, site, data in queries])
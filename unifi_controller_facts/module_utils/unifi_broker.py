@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------------------------------------------------
+# Client side of the local UniFi broker (see bin/unifi_broker.py)
+# ---------------------------------------------------------------------------------------------------------------------
+# The broker keeps one logged in, pooled UniFiClient per controller and serves queries over a Unix socket, so forks
+# running the module do not each log in and open their own TLS connections.
+#
+# Protocol: one JSON object per line in each direction, one request per connection.
+#  request  => {"controller_baseURL", "controller_username", "controller_password", "controller_site", "query", "data"}
+#  response => {"status_code": (int), "text": (str)}             the controller answered the query
+#              {"login": {"status_code": (int), "data": (json)}} the controller rejected the login
+#              {"error": (str)}                                  the broker could not reach the controller
+# ---------------------------------------------------------------------------------------------------------------------
+
+import json
+import os
+import socket
+
+DEFAULT_BROKER_SOCKET = os.path.join("~", ".ansible", "unifi_broker.sock")
+BROKER_SOCKET_ENV = "UNIFI_BROKER_SOCKET"
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: BrokerResponse
+# ---------------------------------------------------------------------------------------------------------------------
+# Stands in for a requests response object so the modules can process broker replies unchanged
+# ---------------------------------------------------------------------------------------------------------------------
+class BrokerResponse(object):
+    __slots__ = ('status_code', 'text')
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: broker_socket_path
+# ---------------------------------------------------------------------------------------------------------------------
+# returns the socket path to use, in order: <path>, $UNIFI_BROKER_SOCKET, ~/.ansible/unifi_broker.sock
+# ---------------------------------------------------------------------------------------------------------------------
+def broker_socket_path(path=None):
+    return os.path.expanduser(path or os.environ.get(BROKER_SOCKET_ENV) or DEFAULT_BROKER_SOCKET)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: send_message / read_message
+# ---------------------------------------------------------------------------------------------------------------------
+# Line delimited JSON framing shared by the broker and its clients
+# ---------------------------------------------------------------------------------------------------------------------
+def send_message(sock, message):
+    sock.sendall(json.dumps(message, separators=(',', ':')).encode('utf-8') + b"\n")
+
+def read_message(sock_file):
+    line = sock_file.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: broker_request
+# ---------------------------------------------------------------------------------------------------------------------
+# Sends one query to the broker
+# required parameter <path>    = (str) Path of the broker socket
+# required parameter <request> = (dict) See the protocol above
+# optional parameter <timeout> = (int) Seconds to wait for the reply (default = 300)
+#
+# Returns the reply dict, or None when no broker is listening so the caller can fall back to talking to the
+# controller directly
+# ---------------------------------------------------------------------------------------------------------------------
+def broker_request(path, request, timeout=300):
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        send_message(sock, request)
+        sock_file = sock.makefile('rb')
+        try:
+            return read_message(sock_file)
+        finally:
+            sock_file.close()
+    except (socket.error, ValueError):
+        return None
+    finally:
+        sock.close()
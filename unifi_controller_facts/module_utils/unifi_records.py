@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------------------------------------------------
+# Compact handling of large controller responses
+# ---------------------------------------------------------------------------------------------------------------------
+# A list_online_clients or stat_all_users answer for a big site holds tens of thousands of 60+ key objects.  Decoding
+# it with json.loads builds one dict per client and costs several times the size of the response text.  This module
+# avoids that:
+#  read_envelope => meta and the type of "data" without decoding "data" at all
+#  iter_data     => the items of the "data" array decoded one at a time
+#  ClientRecord / DeviceRecord => __slots__ records holding only the fields the module works with, repeated strings
+#                                 (essid, oui, ap_mac, ...) interned so every record shares one copy
+# ---------------------------------------------------------------------------------------------------------------------
+
+import json
+import re
+from sys import intern
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+_structure = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]')
+
+DATA_KINDS = {'[': 'list', '{': 'object'}
+
+
+def _skip_ws(text, idx):
+    return _whitespace.match(text, idx).end()
+
+def _expect(text, idx, char):
+    if text[idx:idx + 1] != char:
+        raise ValueError("Expected %r at position %d" % (char, idx))
+    return _skip_ws(text, idx + 1)
+
+# Position of the first member of the top level object, None when the object is empty
+def _object_start(text):
+    idx = _expect(text, _skip_ws(text, 0), '{')
+    if text[idx:idx + 1] == '}':
+        return None
+    return idx
+
+# Reads a member key, returns it with the position of its value
+def _read_key(text, idx):
+    key, idx = _decoder.raw_decode(text, idx)
+    return key, _expect(text, _skip_ws(text, idx), ':')
+
+# Position of the next member after a value ending at <end>, None at the end of the object
+def _next_member(text, end):
+    idx = _skip_ws(text, end)
+    if text[idx:idx + 1] == '}':
+        return None
+    return _expect(text, idx, ',')
+
+# End position of the value starting at <idx>, without building it
+def _skip_value(text, idx):
+    if text[idx:idx + 1] not in ('[', '{'):
+        return _decoder.raw_decode(text, idx)[1]
+    depth = 0
+    for token in _structure.finditer(text, idx):
+        char = token.group()
+        if char in ('[', '{'):
+            depth += 1
+        elif char in (']', '}'):
+            depth -= 1
+            if depth == 0:
+                return token.end()
+    raise ValueError("Unterminated value at position %d" % idx)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: read_envelope
+# ---------------------------------------------------------------------------------------------------------------------
+# required parameter <text> = (str) A controller response body
+#
+# Returns
+#  (meta, data_kind) where meta is the decoded "meta" object ({} when missing) and data_kind is 'list', 'object',
+#  'other', or None when there is no "data" member
+# ---------------------------------------------------------------------------------------------------------------------
+def read_envelope(text):
+    meta = None
+    data_kind = None
+    idx = _object_start(text)
+    while idx is not None:
+        key, idx = _read_key(text, idx)
+        if key == 'data':
+            data_kind = DATA_KINDS.get(text[idx:idx + 1], 'other')
+            if meta is not None:
+                break
+            end = _skip_value(text, idx)
+        else:
+            value, end = _decoder.raw_decode(text, idx)
+            if key == 'meta':
+                meta = value
+                if data_kind is not None:
+                    break
+        idx = _next_member(text, end)
+    return meta or {}, data_kind
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Function: iter_data
+# ---------------------------------------------------------------------------------------------------------------------
+# Yields the items of the "data" array of a controller response body one at a time, nothing when "data" is missing or
+# not an array
+# required parameter <text> = (str) A controller response body
+# ---------------------------------------------------------------------------------------------------------------------
+def iter_data(text):
+    idx = _object_start(text)
+    while idx is not None:
+        key, idx = _read_key(text, idx)
+        if key == 'data' and text[idx:idx + 1] == '[':
+            idx = _skip_ws(text, idx + 1)
+            if text[idx:idx + 1] == ']':
+                return
+            while True:
+                item, idx = _decoder.raw_decode(text, idx)
+                yield item
+                idx = _skip_ws(text, idx)
+                if text[idx:idx + 1] == ']':
+                    return
+                idx = _expect(text, idx, ',')
+        idx = _next_member(text, _skip_value(text, idx))
+
+
+def _mac(value):
+    if value is None:
+        return None
+    return intern(str(value).strip().lower())
+
+def _interned(value):
+    if isinstance(value, str):
+        return intern(value)
+    return value
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: Record
+# ---------------------------------------------------------------------------------------------------------------------
+# Base of the compact records.  Subclasses list their fields in __slots__, the ones in MACS are normalized to lower
+# case and interned, the ones in INTERNED are interned as is, everything else is copied.
+# ---------------------------------------------------------------------------------------------------------------------
+class Record(object):
+    __slots__ = ()
+    MACS = ()
+    INTERNED = ()
+
+    @classmethod
+    def from_dict(cls, item):
+        record = cls.__new__(cls)
+        for field in cls.__slots__:
+            value = item.get(field)
+            if field in cls.MACS:
+                value = _mac(value)
+            elif field in cls.INTERNED:
+                value = _interned(value)
+            setattr(record, field, value)
+        return record
+
+    @classmethod
+    def from_text(cls, text):
+        return [cls.from_dict(item) for item in iter_data(text)]
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: ClientRecord
+# ---------------------------------------------------------------------------------------------------------------------
+# One client from list_online_clients, list_users or stat_all_users
+# ---------------------------------------------------------------------------------------------------------------------
+class ClientRecord(Record):
+    __slots__ = ('mac', 'name', 'hostname', 'ip', 'oui', 'is_wired', 'is_guest', 'essid', 'network', 'ap_mac', 'sw_mac',
+                 'sw_port', 'radio', 'channel', 'signal', 'uptime', 'tx_bytes', 'rx_bytes', 'last_seen')
+    MACS = ('mac', 'ap_mac', 'sw_mac')
+    INTERNED = ('oui', 'essid', 'network', 'radio')
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: DeviceRecord
+# ---------------------------------------------------------------------------------------------------------------------
+# One device from list_devices, with the nested uplink object flattened and lldp_table reduced to
+# (chassis mac, local port) tuples
+# ---------------------------------------------------------------------------------------------------------------------
+class DeviceRecord(Record):
+    __slots__ = ('mac', 'name', 'model', 'type', 'ip', 'version', 'state', 'uplink_mac', 'uplink_remote_port', 'lldp_table')
+    MACS = ('mac',)
+    INTERNED = ('model', 'type', 'version')
+
+    @classmethod
+    def from_dict(cls, item):
+        uplink = item.get('uplink') or {}
+        flattened = dict(item)
+        flattened['uplink_mac'] = uplink.get('uplink_mac')
+        flattened['uplink_remote_port'] = uplink.get('uplink_remote_port')
+        flattened['lldp_table'] = None
+        record = super(DeviceRecord, cls).from_dict(flattened)
+        record.uplink_mac = _mac(record.uplink_mac)
+        record.lldp_table = [(_mac(neighbour.get('chassis_id')), neighbour.get('local_port_idx'))
+                             for neighbour in item.get('lldp_table') or [] if neighbour.get('chassis_id') is not None]
+        return record
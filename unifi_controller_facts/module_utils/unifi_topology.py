@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------------------------------------------------
+# Network topology index built from list_devices and list_online_clients results
+# ---------------------------------------------------------------------------------------------------------------------
+# One pass over the devices and clients builds a graph indexed by MAC address:
+#  nodes    => mac -> [type, name, parent mac, parent port]   (see NODE_FIELDS)
+#  children => mac -> [child macs]
+#  ports    => switch/gateway mac -> {port: [macs on that port]}
+#
+# Parents come from the device "uplink" objects and the client sw_mac/sw_port or ap_mac fields.  Devices that do not
+# report an uplink are placed using the "lldp_table" of the switch that sees them.  Path-to-gateway walks the parent
+# links and downstream walks the children, so both are linear in the size of the answer.
+#
+# The graph is built from the compact records of unifi_records.py, so the full client objects never need to be held
+# in memory at once.
+#
+# Usage
+#  topology = Topology(DeviceRecord.from_text(devices_response.text), ClientRecord.from_text(clients_response.text))
+#  topology = Topology.from_dicts(client.query('list_devices'), client.query('list_online_clients'))
+#  topology.path_to_gateway("aa:bb:cc:dd:ee:ff")
+# ---------------------------------------------------------------------------------------------------------------------
+
+try:
+    from ansible.module_utils.unifi_records import ClientRecord, DeviceRecord
+except ImportError:
+    from unifi_records import ClientRecord, DeviceRecord
+
+NODE_FIELDS = ['type', 'name', 'parent', 'port']
+
+GATEWAY_TYPES = ('ugw', 'udm', 'uxg')
+
+
+def normalize_mac(mac):
+    if mac is None:
+        return None
+    return str(mac).strip().lower()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Class: Topology
+# ---------------------------------------------------------------------------------------------------------------------
+# required parameter <devices> = (list) DeviceRecords from list_devices
+# required parameter <clients> = (list) ClientRecords from list_online_clients
+# ---------------------------------------------------------------------------------------------------------------------
+class Topology(object):
+
+    def __init__(self, devices, clients):
+        self.nodes = {}
+        self.children = {}
+        self.ports = {}
+        self.gateway = None
+        lldp_neighbours = {}
+
+        for device in devices:
+            mac = device.mac
+            if mac is None:
+                continue
+            self.nodes[mac] = [device.type, device.name or device.model, device.uplink_mac, device.uplink_remote_port]
+            if device.type in GATEWAY_TYPES and self.gateway is None:
+                self.gateway = mac
+            for chassis, port in device.lldp_table:
+                lldp_neighbours.setdefault(chassis, []).append((mac, port))
+
+        # The gateway uplink is the WAN side (modem, ISP router), the graph stops there
+        if self.gateway is not None:
+            self.nodes[self.gateway][2] = self.nodes[self.gateway][3] = None
+
+        # LLDP fills in devices that did not report an uplink, ignoring the neighbour on the other end of their own
+        # downlinks
+        for mac, node in self.nodes.items():
+            if node[2] is not None or mac == self.gateway:
+                continue
+            for neighbour, port in lldp_neighbours.get(mac, []):
+                if neighbour in self.nodes and self.nodes[neighbour][2] != mac:
+                    node[2], node[3] = neighbour, port
+                    break
+
+        for client in clients:
+            mac = client.mac
+            if mac is None or mac in self.nodes:
+                continue
+            if client.is_wired:
+                parent, port = client.sw_mac, client.sw_port
+            else:
+                parent, port = client.ap_mac, None
+            self.nodes[mac] = ['client', client.name or client.hostname, parent, port]
+
+        for mac, node in self.nodes.items():
+            parent, port = node[2], node[3]
+            if parent is None:
+                continue
+            self.children.setdefault(parent, []).append(mac)
+            if port is not None:
+                self.ports.setdefault(parent, {}).setdefault(str(port), []).append(mac)
+
+        # Non-device LLDP neighbours (phones, unmanaged switches) still occupy the port they were seen on
+        for chassis, seen in lldp_neighbours.items():
+            if chassis in self.nodes:
+                continue
+            for mac, port in seen:
+                if port is not None:
+                    self.ports.setdefault(mac, {}).setdefault(str(port), []).append(chassis)
+
+        if self.gateway is None:
+            for mac, node in self.nodes.items():
+                if node[0] != 'client' and node[2] is None:
+                    self.gateway = mac
+                    break
+
+    # Builds the index from plain device and client dicts, e.g. the decoded data of UniFiClient.query()
+    @classmethod
+    def from_dicts(cls, devices, clients):
+        return cls([DeviceRecord.from_dict(device) for device in devices], [ClientRecord.from_dict(client) for client in clients])
+
+    # returns the macs from <mac> up to the gateway (or the last known parent), both ends included
+    def path_to_gateway(self, mac):
+        mac = normalize_mac(mac)
+        path = []
+        seen = set()
+        while mac in self.nodes and mac not in seen:
+            path.append(mac)
+            seen.add(mac)
+            mac = self.nodes[mac][2]
+        return path
+
+    # returns every mac below <mac>, breadth first
+    def downstream(self, mac):
+        mac = normalize_mac(mac)
+        found = []
+        seen = set([mac])
+        queue = [mac]
+        while queue:
+            next_queue = []
+            for parent in queue:
+                for child in self.children.get(parent, []):
+                    if child not in seen:
+                        seen.add(child)
+                        found.append(child)
+                        next_queue.append(child)
+            queue = next_queue
+        return found
+
+    # returns {port: [macs]} for a switch or gateway
+    def port_occupancy(self, mac):
+        return self.ports.get(normalize_mac(mac), {})
+
+    def to_dict(self):
+        return {
+            "gateway": self.gateway,
+            "fields": NODE_FIELDS,
+            "nodes": self.nodes,
+            "children": self.children,
+            "ports": self.ports,
+        }